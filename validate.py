@@ -4,49 +4,92 @@ Validation script for draw.io XML files.
 Tests structural requirements identified in the research.
 """
 
+import io
+import mmap
+import os
 import sys
 import re
 import xml.etree.ElementTree as ET
+from collections import Counter
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Tuple, Union
+
+# Precompiled patterns, shared across all files and cells
+_LITERAL_BSN_RE = re.compile(rb'value="[^"]*\\n[^"]*"')
+# Matches & not followed by valid entity (amp, lt, gt, quot, apos, or numeric)
+_UNSAFE_AMP_RE = re.compile(r'&(?!amp;|lt;|gt;|quot;|apos;|#\d+;|#x[0-9a-fA-F]+;)')
+_BR_TAG_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+# value=" with no closing quote before the end of the line
+_MULTILINE_VAL_RE = re.compile(rb'value="[^"\n]*(?:\n|\Z)')
+
+# Supported file formats; binary exports can be several MB, so they are
+# memory-mapped rather than copied
+_DRAWIO_SUFFIXES = ('.drawio', '.drawio.png', '.drawio.svg')
+_MAPPED_SUFFIXES = ('.drawio.png', '.drawio.svg')
+
+# Below this much input, process pool start-up costs more than it saves
+_PARALLEL_MIN_BYTES = 2 * 1024 * 1024
+
+
+def _read_buffer(filepath: Path) -> Union[bytes, mmap.mmap]:
+    """Return the file contents as bytes, or as a read-only mmap for binary exports."""
+    with open(filepath, 'rb') as f:
+        if os.path.normcase(filepath.name).endswith(_MAPPED_SUFFIXES) and os.fstat(f.fileno()).st_size:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
 
 
 def validate_drawio_file(filepath: Path) -> Tuple[bool, List[str]]:
     """
     Validate a draw.io file against structural requirements.
     
+    Returns:
+        Tuple of (is_valid, list_of_errors)
+    """
+    try:
+        # Read the file once; the same buffer feeds byte-level scanning and XML parsing
+        raw = _read_buffer(filepath)
+    except Exception as e:
+        return False, [f"Unexpected error: {e}"]
+    
+    try:
+        return validate_drawio_content(raw)
+    finally:
+        if isinstance(raw, mmap.mmap):
+            raw.close()
+
+
+def validate_drawio_content(raw: Union[bytes, mmap.mmap]) -> Tuple[bool, List[str]]:
+    """
+    Validate draw.io XML already loaded into memory (bytes or mmap).
+    
     Returns:
         Tuple of (is_valid, list_of_errors)
     """
     errors = []
     
     try:
-        # Read entire file for raw text scanning
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            lines = content.splitlines()
-        
         # Check 0a: XML declaration must be first line
-        if not lines or not lines[0].strip().startswith('<?xml'):
+        # The declaration can only sit at offset 0 (after an optional UTF-8 BOM)
+        start = 3 if raw[:3] == b'\xef\xbb\xbf' else 0
+        if raw[start:start + 5] != b'<?xml':
             errors.append("Missing XML declaration (<?xml version=\"1.0\" encoding=\"UTF-8\"?>)")
         
         # Check 0b: Detect literal backslash-n sequences in value attributes
-        literal_backslash_n_pattern = re.compile(r'value="[^"]*\\n[^"]*"')
-        if literal_backslash_n_pattern.search(content):
+        # Substring prefilter skips the regex on clean files
+        if raw.find(b'\\n') != -1 and _LITERAL_BSN_RE.search(raw):
             errors.append("Found literal '\\n' in value attribute - use XML entity &#xa; or <br/> with html=1")
         
         # Check 0d: Detect multi-line value attributes (opening quote and closing quote on different lines)
-        for i, line in enumerate(lines, 1):
-            # Look for value=" without closing " on same line
-            if 'value="' in line:
-                # Count quotes after value=
-                value_start = line.find('value="')
-                after_value = line[value_start + 7:]  # Skip 'value="'
-                # If we don't find a closing quote (or only find escaped quotes), it's multi-line
-                if '"' not in after_value or after_value.count('"') < 1:
-                    errors.append(f"Line {i}: Multi-line value attribute detected - keep value on single line")
-        
-        tree = ET.parse(filepath)
+        # One regex pass over the raw bytes; line numbers are counted incrementally
+        line_no = 1
+        last_pos = 0
+        for match in _MULTILINE_VAL_RE.finditer(raw):
+            line_no += raw[last_pos:match.start()].count(b'\n')
+            last_pos = match.start()
+            errors.append(f"Line {line_no}: Multi-line value attribute detected - keep value on single line")
+        
+        tree = ET.parse(raw if isinstance(raw, mmap.mmap) else io.BytesIO(raw))
         root = tree.getroot()
         
         # Check 1: Root structure exists
@@ -70,73 +113,78 @@ def validate_drawio_file(filepath: Path) -> Tuple[bool, List[str]]:
             errors.append("Missing <root> element")
             return False, errors
         
-        # Check 2: Required root cells exist
-        cells = {cell.get('id'): cell for cell in graph_root.findall('mxCell')}
+        # Single traversal of the cell list; every check below reuses it
+        mxcells = list(graph_root.iterfind('mxCell'))
+        cells = {}
+        all_ids = []
+        for cell in mxcells:
+            cell_id = cell.get('id')
+            all_ids.append(cell_id)
+            cells[cell_id] = cell
         
+        # Check 2: Required root cells exist
         if '0' not in cells:
             errors.append("Missing root cell (id='0')")
         
         if '1' not in cells:
             errors.append("Missing default layer (id='1')")
-        elif cells['1'].get('parent') != '0':
+        elif cells['1'].attrib.get('parent') != '0':
             errors.append("Default layer (id='1') must have parent='0'")
         
         # Check 3: All IDs are unique
-        all_ids = [cell.get('id') for cell in graph_root.findall('mxCell')]
-        if len(all_ids) != len(set(all_ids)):
-            duplicates = [id for id in all_ids if all_ids.count(id) > 1]
+        id_counts = Counter(all_ids)
+        duplicates = [cell_id for cell_id, count in id_counts.items() if count > 1]
+        if duplicates:
             errors.append(f"Duplicate IDs found: {set(duplicates)}")
         
-        # Check 4: All parent references are valid
-        for cell in graph_root.findall('mxCell'):
-            cell_id = cell.get('id')
-            parent = cell.get('parent')
+        # Check 7: Page setting (warning, not error)
+        page = model.get('page')
+        if page == '1':
+            errors.append("WARNING: page='1' with fixed dimensions - consider page='0' for web use")
+        
+        # Per-cell checks, fused into one pass now that the ID index is complete
+        cell_ids = frozenset(cells)
+        for cell in mxcells:
+            # Hoist the attribute mapping once per cell
+            attrib = cell.attrib
+            cell_id = attrib.get('id')
+            is_edge = attrib.get('edge') == '1'
             
-            if parent and parent not in cells:
+            # Check 4: All parent references are valid
+            parent = attrib.get('parent')
+            if parent and parent not in cell_ids:
                 errors.append(f"Cell '{cell_id}' references non-existent parent '{parent}'")
-        
-        # Check 5: All edge source/target references are valid
-        for cell in graph_root.findall('mxCell'):
-            if cell.get('edge') == '1':
-                cell_id = cell.get('id')
-                source = cell.get('source')
-                target = cell.get('target')
+            
+            # Check 5: All edge source/target references are valid
+            if is_edge:
+                source = attrib.get('source')
+                target = attrib.get('target')
                 
-                if source and source not in cells:
+                if source and source not in cell_ids:
                     errors.append(f"Edge '{cell_id}' references non-existent source '{source}'")
                 
-                if target and target not in cells:
+                if target and target not in cell_ids:
                     errors.append(f"Edge '{cell_id}' references non-existent target '{target}'")
-        
-        # Check 6: All geometry elements have as="geometry"
-        for cell in graph_root.findall('mxCell'):
+            
+            # Check 6: All geometry elements have as="geometry"
             geometry = cell.find('mxGeometry')
             if geometry is not None and geometry.get('as') != 'geometry':
-                cell_id = cell.get('id')
                 errors.append(f"Cell '{cell_id}' geometry missing as='geometry' attribute")
-        
-        # Check 7: Page setting (warning, not error)
-        page = model.get('page')
-        if page == '1':
-            errors.append("WARNING: page='1' with fixed dimensions - consider page='0' for web use")
-        
-        # Check 8: All content cells have vertex or edge attribute
-        for cell in graph_root.findall('mxCell'):
-            cell_id = cell.get('id')
+            
+            # Check 8: All content cells have vertex or edge attribute
             if cell_id not in ['0', '1']:
-                if cell.get('vertex') != '1' and cell.get('edge') != '1':
+                if attrib.get('vertex') != '1' and not is_edge:
                     errors.append(f"Cell '{cell_id}' missing vertex='1' or edge='1' attribute")
-        
-        # Check 9: Label values should not contain unescaped XML special characters or use <br/> incorrectly
-        # Pattern matches & not followed by valid entity (amp, lt, gt, quot, apos, or numeric)
-        unsafe_char_pattern = re.compile(r'&(?!amp;|lt;|gt;|quot;|apos;|#\d+;|#x[0-9a-fA-F]+;)')
-        for cell in graph_root.findall('mxCell'):
-            cell_id = cell.get('id')
-            value = cell.get('value', '')
-            style = cell.get('style', '')
+            
+            # Check 9: Label values should not contain unescaped XML special characters or use <br/> incorrectly
+            # Most structural cells have no label, so skip the value checks entirely
+            value = attrib.get('value')
+            if not value:
+                continue
+            style = attrib.get('style', '')
             
             # Check for unescaped ampersand
-            if unsafe_char_pattern.search(value):
+            if '&' in value and _UNSAFE_AMP_RE.search(value):
                 errors.append(f"Cell '{cell_id}' value contains unescaped '&' - use 'and' instead")
             
             # Check for < and > with proper <br/> handling
@@ -146,8 +194,11 @@ def validate_drawio_file(filepath: Path) -> Tuple[bool, List[str]]:
                 # If html=1, allow only <br/> or <br> tags
                 if has_html:
                     # Remove valid <br/> and <br> tags, then check for remaining <
-                    cleaned = re.sub(r'<br\s*/?>','', value, flags=re.IGNORECASE)
-                    if '<' in cleaned:
+                    # Each common <br> spelling holds exactly one '<', so when they account
+                    # for every '<' the regex would strip them all; otherwise run it on
+                    # the original value (sequential replaces could join new tags)
+                    br_tags = value.count('<br/>') + value.count('<br />') + value.count('<br>')
+                    if value.count('<') != br_tags and '<' in _BR_TAG_RE.sub('', value):
                         errors.append(f"Cell '{cell_id}' value contains '<' other than <br/> - use 'less than' instead")
                 else:
                     errors.append(f"Cell '{cell_id}' value contains '<' without html=1 in style - use 'less than' or add html=1")
@@ -167,6 +218,20 @@ def validate_drawio_file(filepath: Path) -> Tuple[bool, List[str]]:
     return len(errors) == 0, errors
 
 
+def _find_drawio_files(directory: Path) -> List[Path]:
+    """List draw.io files in a directory with a single scandir pass."""
+    # normcase folds case on Windows only, matching Path.glob's behaviour
+    with os.scandir(directory) as entries:
+        return [Path(entry.path) for entry in entries
+                if os.path.normcase(entry.name).endswith(_DRAWIO_SUFFIXES) and entry.is_file()]
+
+
+def _validate_one(filepath: Path) -> Tuple[str, bool, List[str]]:
+    """Validate a single file in a worker process, tagging the result with its name."""
+    is_valid, errors = validate_drawio_file(filepath)
+    return filepath.name, is_valid, errors
+
+
 def main():
     """Validate all draw.io files in examples directory or specified files."""
     
@@ -181,9 +246,7 @@ def main():
             if path.is_file():
                 drawio_files.append(path)
             elif path.is_dir():
-                drawio_files.extend(list(path.glob('*.drawio')))
-                drawio_files.extend(list(path.glob('*.drawio.png')))
-                drawio_files.extend(list(path.glob('*.drawio.svg')))
+                drawio_files.extend(_find_drawio_files(path))
             else:
                 print(f"Warning: {arg} not found, skipping")
     else:
@@ -195,9 +258,7 @@ def main():
             sys.exit(1)
         
         # Support .drawio, .drawio.png, and .drawio.svg formats
-        drawio_files = (list(examples_dir.glob('*.drawio')) + 
-                        list(examples_dir.glob('*.drawio.png')) + 
-                        list(examples_dir.glob('*.drawio.svg')))
+        drawio_files = _find_drawio_files(examples_dir)
     
     if not drawio_files:
         print(f"No .drawio, .drawio.png, or .drawio.svg files found in {examples_dir}")
@@ -205,30 +266,35 @@ def main():
     
     print(f"Validating {len(drawio_files)} draw.io files...\n")
     
-    all_valid = True
-    results = []
-    
-    for filepath in sorted(drawio_files):
-        is_valid, errors = validate_drawio_file(filepath)
-        results.append((filepath.name, is_valid, errors))
-        
-        if not is_valid:
-            all_valid = False
+    # Files are independent, so large batches are validated in parallel;
+    # map keeps sorted order
+    ordered_files = sorted(drawio_files)
+    workers = min(len(ordered_files), os.cpu_count() or 1)
+    if workers > 1 and sum(f.stat().st_size for f in ordered_files) >= _PARALLEL_MIN_BYTES:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_validate_one, ordered_files))
+    else:
+        results = [_validate_one(filepath) for filepath in ordered_files]
     
-    # Print results
+    # Build the report in memory and write it once rather than per line
+    out = []
+    valid_count = 0
     for filename, is_valid, errors in results:
+        valid_count += is_valid
         status = "✓ VALID" if is_valid else "✗ INVALID"
-        print(f"{status}: {filename}")
+        out.append(f"{status}: {filename}\n")
         
         if errors:
             for error in errors:
                 prefix = "  WARNING: " if error.startswith("WARNING") else "  ERROR: "
-                print(f"{prefix}{error}")
-            print()
+                out.append(f"{prefix}{error}\n")
+            out.append("\n")
     
     # Summary
-    valid_count = sum(1 for _, is_valid, _ in results if is_valid)
-    print(f"\nResults: {valid_count}/{len(results)} files valid")
+    all_valid = valid_count == len(results)
+    out.append(f"\nResults: {valid_count}/{len(results)} files valid\n")
+    sys.stdout.write(''.join(out))
     
     sys.exit(0 if all_valid else 1)
 